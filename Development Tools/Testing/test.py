@@ -3,7 +3,7 @@
 
 """
 This script makes testing changes a little easier by running the converter for
-three known example HiTrack files then comparing the output to the currently
+four known example HiTrack files then comparing the output to the currently
 accepted correct output.
 
 Copy the Huawei-TCX-Converter.py file that is being tested to this directory and
@@ -11,7 +11,7 @@ run test.py
 """
 
 # Import main function
-import os, sys
+import os, re, sys
 converter = __import__('Huawei-TCX-Converter')
 
 print('- Testing -')
@@ -21,7 +21,7 @@ std_stdout = sys.stdout
 sys.stdout = open('logfile', 'w')
 
 # Loop over files calling the converter
-files = ['HiTrack_1', 'HiTrack_2', 'HiTrack_3']
+files = ['HiTrack_1', 'HiTrack_2', 'HiTrack_3', 'HiTrack_4']
 for file in files:
 
     sys.argv = ['', '-v', file]
@@ -33,8 +33,12 @@ for file in files:
         print('Conversion failed for '+file+': ')
         print('\t'+e)
         exit()
-    # Delete tcx file once done
-    os.remove(file+'.tcx')
+    # Log lap distances, then delete tcx file once done (tracks without laps don't produce one)
+    if os.path.exists(file+'.tcx'):
+        with open(file+'.tcx', 'r') as tcx:
+            laps = re.findall(r'<Lap [^>]*>\s*<TotalTimeSeconds>[^<]*</TotalTimeSeconds>\s*<DistanceMeters>([^<]*)<', tcx.read())
+        print('laps: '+', '.join(lap+'m' for lap in laps)+'\n')
+        os.remove(file+'.tcx')
 
 # Print results
 sys.stdout = std_stdout
@@ -2,8 +2,7 @@
 # Ari Cooper-Davis, 2019 - github.com/aricooperdavis/Huawei-TCX-Converter
 
 # Import resources from Standard Library
-import xml.etree.cElementTree as ET # TCX (type of XML) construction
-import math, operator, sys # Distance calcs, sorting by timestamp, arguments
+import bisect, heapq, itertools, math, operator, os, sys # Timestamp lookup, merging by timestamp, cumulative distance, distance calcs, sorting by timestamp, removing partial files, arguments
 from datetime import datetime as dt # Time formatting
 # Import external resources
 from typing import List, Union
@@ -15,6 +14,28 @@ try:
 except ModuleNotFoundError:
     xmlschema_found = False
 
+try:
+    import numpy as np # Vectorised distance calcs
+    numpy_found = True
+except ModuleNotFoundError:
+    numpy_found = False
+
+# WGS 84
+WGS84_A = 6378137
+WGS84_F = 1 / 298.257223563
+WGS84_B = 6356752.314245
+VINCENTY_MAX_ITERATIONS = 200
+VINCENTY_CONVERGENCE_THRESHOLD = 1e-12
+# Derived constants, so they aren't recalculated for every pair of points
+WGS84_ONE_MINUS_F = 1 - WGS84_F
+WGS84_F_16 = WGS84_F / 16
+WGS84_A2_MINUS_B2 = WGS84_A ** 2 - WGS84_B ** 2
+WGS84_B2 = WGS84_B ** 2
+# Mean earth radius (in m) for haversine distances
+EARTH_MEAN_RADIUS = 6371008.8
+# Points closer together than this (in m) use the haversine distance rather than vincenty
+HAVERSINE_THRESHOLD = 0.5
+
 def parse_arguments() -> tuple:
     """
     Parses command line arguments for filename and options
@@ -65,6 +86,94 @@ def parse_arguments() -> tuple:
 
     return input_file, options
 
+def _normalize_timestamp(timestamp: float) -> int:
+    """ Normalize the timestamp
+
+    Timestamps taken from different devices can have different values. Most common are seconds
+    (i.e. t=1.543646826E9) or microseconds (i.e. t=1.55173212E12).
+    This method implements a generic normalization function that transform all values to valid
+    unix timestamps (integer with 10 digits).
+    Integers (whole seconds) are returned so that timestamps can be compared for equality reliably.
+    Any sub-second part is dropped, so records (including gps fixes) from the same second share a
+    timestamp and are later merged into a single trackpoint by merge_data.
+    """
+    oom = int(math.log10(timestamp))
+    if oom == 9:
+        return int(timestamp)
+
+    if oom > 9:
+        return int(timestamp // 10 ** (oom - 9))
+    return int(timestamp * 10 ** (9 - oom))
+
+def _parse_fields(line: str) -> dict:
+    """ Split a record into its key=value fields in a single pass
+
+    E.g. 'tp=h-r;k=1552679418000;v=93;' becomes {'tp': 'h-r', 'k': '1552679418000', 'v': '93'}
+    """
+    fields = {}
+    for segment in line.rstrip(';\r\n').split(';'):
+        key, _, value = segment.partition('=')
+        fields[key] = value
+    return fields
+
+def _parse_location(line: str, data: dict, lap_start_stop: list):
+    """ Parse a location (tp=lbs) record into data, updating the current lap's start-stop times """
+    fields = _parse_fields(line)
+    time, lat, lon = float(fields['t']), float(fields['lat']), float(fields['lon'])
+    """ Do not try to normalize time for 'Pauze' records.
+         E.g. tp=lbs;k=<a number>;lat=90.0;lon=-80.0;alt=0.0;t=0.0;
+         Recognized by time = 0, lat = 90, long = -80
+    """
+    if time != 0 and lat != 90 and lon != -80:
+        time = _normalize_timestamp(time)
+        # time, lat, long, [alti], [dist], [hr], [cad]
+        data['gps'].append((time, lat, lon, None, None, None, None))
+        if lap_start_stop[0] == 0:
+            # First valid time for new lap. Store it in start time (index 0).
+            lap_start_stop[0] = time
+        if lap_start_stop[1] < time:
+            # Later stop time for current lap. Store it in stop time (index 1).
+            lap_start_stop[1] = time
+    else:
+        """ Pauze record detected.
+             E.g. tp=lbs;k=<a number>;lat=90.0;lon=-80.0;alt=0.0;t=0.0;
+             Recognized by time = 0, lat = 90, long = -80
+             Add the record to the gps data list. When generating the TCX XML this record can be
+             used to create a new 'lap' with start time the time of the next record (if any, e.g.
+             when workout was first pauzed and then stopped without resuming.)
+             Store lap record in data (unless no location was recorded since the last pauze) and start a new one.
+        """
+        if lap_start_stop[0] != 0:
+            data['lap'].append(lap_start_stop[:])
+        lap_start_stop[0] = 0
+        lap_start_stop[1] = 0
+
+def _parse_heart_rate(line: str, data: dict, lap_start_stop: list):
+    """ Parse a heart-rate (tp=h-r) record into data """
+    fields = _parse_fields(line)
+    #time, [lat], [long], [alti], [dist], hr, [cad]
+    data['hr'].append((_normalize_timestamp(int(float(fields['k']))), None, None, None, None, int(fields['v']), None))
+
+def _parse_cadence(line: str, data: dict, lap_start_stop: list):
+    """ Parse a cadence (tp=s-r) record into data """
+    fields = _parse_fields(line)
+    #time, [lat], [long], [alti], [dist], [hr], cad
+    data['cad'].append((_normalize_timestamp(int(float(fields['k']))), None, None, None, None, None, int(fields['v'])))
+
+def _parse_altitude(line: str, data: dict, lap_start_stop: list):
+    """ Parse an altitude (tp=alti) record into data """
+    fields = _parse_fields(line)
+    #time, [lat], [long], alti, [dist], [hr], [cad]
+    data['alti'].append((_normalize_timestamp(int(float(fields['k']))), None, None, float(fields['v']), None, None, None))
+
+# Parser for each type of record (the text before the first ';'), other types are ignored
+RECORD_PARSERS = {
+    'tp=lbs': _parse_location, # Location lines
+    'tp=h-r': _parse_heart_rate, # Heart-rate lines
+    'tp=s-r': _parse_cadence, # Cadence lines
+    'tp=alti': _parse_altitude, # Altitude lines
+}
+
 def read_file(input_file: str) -> dict:
     """
     Read the file and extract relevant data
@@ -76,117 +185,48 @@ def read_file(input_file: str) -> dict:
 
     Returns
     -------
-    data: dict of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    data: dict of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
     """
 
-    def _normalize_timestamp(timestamp: float) -> float:
-        """ Normalize the timestamp
-
-        Timestamps taken from different devices can have different values. Most common are seconds
-        (i.e. t=1.543646826E9) or microseconds (i.e. t=1.55173212E12).
-        This method implements a generic normalization function that transform all values to valid
-        unix timestamps (integer with 10 digits).
-        """
-        oom = int(math.log10(timestamp))
-        if oom == 9:
-            return timestamp
-
-        divisor = 10 ** (oom - 9) if oom > 9 else 0.1 ** (9 - oom)
-        return timestamp / divisor
-
     print('---- Input File ----')
     print('reading: ', end='')
     try:
-        """ The lap list will contain lap data will contain start-stop times between pauzes identified in 
-            the location records. These are required to generate the laps in the output TCX file later.
-        """
-        data = {'gps': [], 'alti': [], 'hr': [], 'cad': [], 'lap': []}
         with open(input_file) as f:
-            lap_start_stop = []
-            lap_start_stop.append(0)  # Start time of lap
-            lap_start_stop.append(0)  # Stop time of lap
-
-            for line in f:
-                # Loop over file line by line
-                holding_list = []
-
-                if line[0:6] == 'tp=lbs': # Location lines
-                    for x in [6,3,4,0,0,0,0]: # time, lat, long, [alti], [dist], [hr], [cad]
-                        if x == 0:
-                            holding_list.append('') # Fill in blanks with blank
-                        else:
-                            holding_list.append(float(line.split('=')[x].split(';')[0]))
-                    """ Do not try to normalize time for 'Pauze' records.
-                         E.g. tp=lbs;k=<a number>;lat=90.0;lon=-80.0;alt=0.0;t=0.0;
-                         Recognized by time = 0, lat = 90, long = -80
-                    """
-                    if holding_list[0] != 0 and holding_list[1] != 90 and holding_list[2] != -80:
-                        holding_list[0] = _normalize_timestamp(holding_list[0])
-                        data['gps'].append(holding_list)
-                        if lap_start_stop[0] == 0:
-                            # First valid time for new lap. Store it in start time (index 0).
-                            lap_start_stop[0] = holding_list[0]
-                        if lap_start_stop[1] < holding_list[0]:
-                            # Later stop time for current lap. Store it in stop time (index 1).
-                            lap_start_stop[1] = holding_list[0]
-                    else:
-                        """ Pauze record detected.
-                             E.g. tp=lbs;k=<a number>;lat=90.0;lon=-80.0;alt=0.0;t=0.0;
-                             Recognized by time = 0, lat = 90, long = -80
-                             Add the record to the gps data list. When generating the TCX XML this record can be
-                             used to create a new 'lap' with start time the time of the next record (if any, e.g.
-                             when workout was first pauzed and then stopped without resuming.)
-                             Store lap record in data and create a new one. 
-                        """
-                        data['lap'].append(lap_start_stop)
-                        lap_start_stop = []
-                        lap_start_stop.append(0)
-                        lap_start_stop.append(0)
-
-                elif line[0:6] == 'tp=h-r': # Heart-rate lines
-                    for x in [2,0,0,0,0,3,0]: #time, [lat], [long], [alti], [dist], hr, [cad]
-                        if x == 0:
-                            holding_list.append('')
-                        elif x == 2:
-                            holding_list.append(int(float(line.split('=')[x].split(';')[0])))
-                        else:
-                            holding_list.append(int(line.split('=')[x].split(';')[0]))
-                    holding_list[0] = _normalize_timestamp(holding_list[0])
-                    data['hr'].append(holding_list)
-
-                elif line[0:6] == 'tp=s-r': # Cadence lines
-                    for x in [2,0,0,0,0,0,3]: #time, [lat], [long], [alti], [dist], [hr], cad
-                        if x == 0:
-                            holding_list.append('')
-                        elif x == 2:
-                            holding_list.append(int(float(line.split('=')[x].split(';')[0])))
-                        else:
-                            holding_list.append(int(line.split('=')[x].split(';')[0]))
-                    holding_list[0] = _normalize_timestamp(holding_list[0])
-                    data['cad'].append(holding_list)
-
-                elif line[0:7] == 'tp=alti': # Altitude lines
-                    for x in [2,0,0,3,0,0,0]: #time, [lat], [long], alti, [dist], [hr], [cad]
-                        if x == 0:
-                            holding_list.append('')
-                        elif x == 2:
-                            holding_list.append(int(float(line.split('=')[x].split(';')[0])))
-                        else:
-                            holding_list.append(float(line.split('=')[x].split(';')[0]))
-                    holding_list[0] = _normalize_timestamp(holding_list[0])
-                    data['alti'].append(holding_list)
-
-        """ Save (last) lap data. When the exercise wasn't pauzed and/or no pauze/stop record is generated as the last
-            location record, store the single lap record here.
-        """
-        if lap_start_stop[0] != 0:
-            data['lap'].append(lap_start_stop)
+            # Read the whole file at once rather than line by line
+            lines = f.read().splitlines()
+    except OSError:
+        print('FAILED')
+        exit()
+
+    """ The lap list will contain lap data will contain start-stop times between pauzes identified in 
+        the location records. These are required to generate the laps in the output TCX file later.
+    """
+    data = {'gps': [], 'alti': [], 'hr': [], 'cad': [], 'lap': []}
+    lap_start_stop = []
+    lap_start_stop.append(0)  # Start time of lap
+    lap_start_stop.append(0)  # Stop time of lap
+
+    for line in lines:
+        # Loop over file line by line, handing each record to the parser for its type
+        parser = RECORD_PARSERS.get(line.partition(';')[0])
+        if parser:
+            parser(line, data, lap_start_stop)
+
+    """ Save (last) lap data. When the exercise wasn't pauzed and/or no pauze/stop record is generated as the last
+        location record, store the single lap record here.
+    """
+    if lap_start_stop[0] != 0:
+        data['lap'].append(lap_start_stop)
 
-        # Sort GPS data by date for distance computation
-        data['gps'] = sorted(data['gps'], key=lambda x : x[0])
+    # Sort data by date for distance computation and merging
+    for key in ['gps', 'alti', 'hr', 'cad']:
+        data[key].sort(key=operator.itemgetter(0))
 
-    except:
+    # Add distances now that the gps data is in order
+    try:
+        _add_distances(data['gps'])
+    except ArithmeticError:
         print('FAILED')
         exit()
 
@@ -199,140 +239,328 @@ def filter_data(data: dict) ->  dict:
 
     Parameters
     ----------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
 
     Returns
     -------
     data : dictionary of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
     """
 
     print('filtering: ', end='')
     original_data = data # Back-up data pre-filtering in case of failure
 
     try:
-        for line in data['hr']:
-            # Heart-rate is too low/high (type is xsd:unsignedbyte)
-            if line[5] < 1 or line[5] > 254:
-                data['hr'].remove(line)
+        # Heart-rate is too low/high (type is xsd:unsignedbyte)
+        data['hr'] = [line for line in data['hr'] if 1 <= line[5] <= 254]
 
-        for line in data['cad']:
-            # Cadence is too low/high (type is xsd:unsignedbyte)
-            if line[6] < 0 or line[6] > 254:
-                data['cad'].remove(line)
+        # Cadence is too low/high (type is xsd:unsignedbyte)
+        data['cad'] = [line for line in data['cad'] if 0 <= line[6] <= 254]
 
-        for line in data['alti']:
-            # Altitude is too low/high (dead sea/everest)
-            if line[3] < -1000 or line[3] > 10000:
-                data['alti'].remove(line)
+        # Altitude is too low/high (dead sea/everest)
+        data['alti'] = [line for line in data['alti'] if -1000 <= line[3] <= 10000]
 
         print('OKAY')
 
-    except:
+    except TypeError: # Unexpected (non-numeric) values
         print('FAILED')
         return original_data
 
     return data
 
-def process_gps(data: dict) -> dict:
+def _reduced_latitude(latitude: float) -> tuple:
     """
-    Add distance information to all gps tagged data points
+    Determine the sine and cosine of the reduced latitude of a coordinate
 
     Parameters
     ----------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    latitude : float
+        Latitude of the point
 
     Returns
     -------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    sinU, cosU : float
+        sine and cosine of the reduced latitude
     """
 
-    def _vincenty(point1: list, point2: list) -> float:
-        """
-        Determine distance between two coordinates
+    U = math.atan(WGS84_ONE_MINUS_F * math.tan(math.radians(latitude)))
+    return math.sin(U), math.cos(U)
 
-        Parameters
-        ----------
-        point1 : Tuple
-            [Latitude of first point, Longitude of first point]
-        point2: Tuple
-            [Latitude of second point, Longitude of second point]
+def _vincenty(point1: list, point2: list) -> float:
+    """
+    Determine distance between two coordinates
 
-        Returns
-        -------
-        s : float
-            distance in m between point1 and point2
+    Parameters
+    ----------
+    point1 : Tuple
+        [Latitude of first point, Longitude of first point]
+    point2: Tuple
+        [Latitude of second point, Longitude of second point]
 
-        """
+    Returns
+    -------
+    s : float
+        distance in m between point1 and point2
+
+    Raises
+    ------
+    ArithmeticError
+        If the calculation does not converge
+
+    """
+
+    if point1[0] == point2[0] and point1[1] == point2[1]:
+        return 0.0
+    sinU1, cosU1 = _reduced_latitude(point1[0])
+    sinU2, cosU2 = _reduced_latitude(point2[0])
+    return _vincenty_reduced(sinU1, cosU1, sinU2, cosU2, math.radians(point2[1] - point1[1]))
 
-        # WGS 84
-        a = 6378137
-        f = 1 / 298.257223563
-        b = 6356752.314245
-        MAX_ITERATIONS = 200
-        CONVERGENCE_THRESHOLD = 1e-12
-        if point1[0] == point2[0] and point1[1] == point2[1]:
+def _vincenty_reduced(sinU1: float, cosU1: float, sinU2: float, cosU2: float, L: float) -> float:
+    """
+    Determine distance between two coordinates from their reduced latitudes
+
+    Lets callers calculate each point's reduced latitude once, rather than
+    once for every pair it is part of.
+
+    Parameters
+    ----------
+    sinU1, cosU1 : float
+        sine and cosine of the reduced latitude of the first point
+    sinU2, cosU2 : float
+        sine and cosine of the reduced latitude of the second point
+    L : float
+        difference in longitude (second - first) in radians
+
+    Returns
+    -------
+    s : float
+        distance in m between the points
+
+    Raises
+    ------
+    ArithmeticError
+        If the calculation does not converge
+    """
+
+    # Local names are quicker to look up than globals/attributes in the loop
+    _sin, _cos, _atan2, _sqrt = math.sin, math.cos, math.atan2, math.sqrt
+    f = WGS84_F
+    b = WGS84_B
+    Lambda = L
+    for iteration in range(VINCENTY_MAX_ITERATIONS):
+        sinLambda = _sin(Lambda)
+        cosLambda = _cos(Lambda)
+        sinSigma = _sqrt((cosU2 * sinLambda) ** 2 +
+                         (cosU1 * sinU2 - sinU1 * cosU2 * cosLambda) ** 2)
+        if sinSigma == 0:
             return 0.0
-        U1 = math.atan((1 - f) * math.tan(math.radians(point1[0])))
-        U2 = math.atan((1 - f) * math.tan(math.radians(point2[0])))
-        L = math.radians(point2[1] - point1[1])
-        Lambda = L
-        sinU1 = math.sin(U1)
-        cosU1 = math.cos(U1)
-        sinU2 = math.sin(U2)
-        cosU2 = math.cos(U2)
-        for iteration in range(MAX_ITERATIONS):
-            sinLambda = math.sin(Lambda)
-            cosLambda = math.cos(Lambda)
-            sinSigma = math.sqrt((cosU2 * sinLambda) ** 2 +
-                                 (cosU1 * sinU2 - sinU1 * cosU2 * cosLambda) ** 2)
-            if sinSigma == 0:
-                return 0.0
-            cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLambda
-            sigma = math.atan2(sinSigma, cosSigma)
-            sinAlpha = cosU1 * cosU2 * sinLambda / sinSigma
-            cosSqAlpha = 1 - sinAlpha ** 2
-            try:
-                cos2SigmaM = cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha
-            except ZeroDivisionError:
-                cos2SigmaM = 0
-            C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
-            LambdaPrev = Lambda
-            Lambda = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma *
-                                                   (cos2SigmaM + C * cosSigma *
-                                                    (-1 + 2 * cos2SigmaM ** 2)))
-            if abs(Lambda - LambdaPrev) < CONVERGENCE_THRESHOLD:
-                break
+        cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLambda
+        sigma = _atan2(sinSigma, cosSigma)
+        sinAlpha = cosU1 * cosU2 * sinLambda / sinSigma
+        cosSqAlpha = 1 - sinAlpha ** 2
+        if cosSqAlpha == 0.0:
+            cos2SigmaM = 0.0
         else:
-            print('Error: unable to calculate distance between GPS points')
-            return None  # TODO: Improve handling of convergence failure
-        uSq = cosSqAlpha * (a ** 2 - b ** 2) / (b ** 2)
-        A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
-        B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
-        deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma *
-                                                           (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
-                                                           (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
-        s = b * A * (sigma - deltaSigma)
-
-        return round(s, 6)
+            cos2SigmaM = cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha
+        C = WGS84_F_16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+        LambdaPrev = Lambda
+        Lambda = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma *
+                                               (cos2SigmaM + C * cosSigma *
+                                                (-1 + 2 * cos2SigmaM ** 2)))
+        if abs(Lambda - LambdaPrev) < VINCENTY_CONVERGENCE_THRESHOLD:
+            break
+    else:
+        print('Error: unable to calculate distance between GPS points')
+        raise ArithmeticError('Vincenty distance did not converge')  # TODO: Improve handling of convergence failure
+    uSq = cosSqAlpha * WGS84_A2_MINUS_B2 / WGS84_B2
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma *
+                                                       (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
+                                                       (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+    s = b * A * (sigma - deltaSigma)
+
+    return round(s, 6)
+
+def _haversine(lat1: Union[float, 'np.ndarray'], lon1: Union[float, 'np.ndarray'],
+               lat2: Union[float, 'np.ndarray'], lon2: Union[float, 'np.ndarray']) -> Union[float, 'np.ndarray']:
+    """
+    Determine great-circle distance between two coordinates
+
+    Much cheaper than _vincenty, and just as good for points that are very
+    close together. Works element-wise when given numpy arrays.
+
+    Parameters
+    ----------
+    lat1, lon1 : float or np.ndarray
+        Latitude and longitude of the first point(s)
+    lat2, lon2 : float or np.ndarray
+        Latitude and longitude of the second point(s)
+
+    Returns
+    -------
+    s : float or np.ndarray
+        distance in m between the points
+    """
+
+    if numpy_found and isinstance(lat1, np.ndarray):
+        sin, cos, asin, sqrt, radians = np.sin, np.cos, np.arcsin, np.sqrt, np.radians
+    else:
+        sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+    phi1 = radians(lat1)
+    phi2 = radians(lat2)
+    h = (sin((phi2 - phi1) / 2) ** 2 +
+         cos(phi1) * cos(phi2) * sin(radians(lon2 - lon1) / 2) ** 2)
+    s = 2 * EARTH_MEAN_RADIUS * asin(sqrt(h))
+
+    return s
+
+def _vincenty_vec(lat: 'np.ndarray', lon: 'np.ndarray') -> 'np.ndarray':
+    """
+    Determine distances between consecutive coordinates
+
+    Vectorised equivalent of _vincenty; all pairs are iterated together until
+    each has converged. Pairs closer than HAVERSINE_THRESHOLD are given their
+    _haversine distance instead.
+
+    Parameters
+    ----------
+    lat, lon : np.ndarray
+        Latitudes and longitudes of the points
+
+    Returns
+    -------
+    s : np.ndarray
+        distances in m from each point to the previous one (one fewer than the
+        number of points), NaN where the calculation did not converge
+    """
+
+    f = WGS84_F
+    b = WGS84_B
+    s = np.zeros(len(lat) - 1)
+    U = np.arctan(WGS84_ONE_MINUS_F * np.tan(np.radians(lat)))
+    sinU = np.sin(U)
+    cosU = np.cos(U)
+    sinU1, cosU1 = sinU[1:], cosU[1:]
+    sinU2, cosU2 = sinU[:-1], cosU[:-1]
+    L = np.radians(lon[:-1] - lon[1:])
+    # Indices of pairs still being iterated (identical points are 0 m apart)
+    todo = np.flatnonzero((lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1]))
+    h = _haversine(lat[1:][todo], lon[1:][todo], lat[:-1][todo], lon[:-1][todo])
+    near = h < HAVERSINE_THRESHOLD
+    s[todo[near]] = h[near]
+    todo = todo[~near]
+    Lambda = L[todo]
+    for iteration in range(VINCENTY_MAX_ITERATIONS):
+        if not todo.size:
+            break
+        sinLambda = np.sin(Lambda)
+        cosLambda = np.cos(Lambda)
+        sinSigma = np.sqrt((cosU2[todo] * sinLambda) ** 2 +
+                           (cosU1[todo] * sinU2[todo] - sinU1[todo] * cosU2[todo] * cosLambda) ** 2)
+        # Coincident points are left at 0 m
+        moving = sinSigma != 0
+        todo, Lambda, sinLambda, cosLambda, sinSigma = (x[moving] for x in (todo, Lambda, sinLambda, cosLambda, sinSigma))
+        cosSigma = sinU1[todo] * sinU2[todo] + cosU1[todo] * cosU2[todo] * cosLambda
+        sigma = np.arctan2(sinSigma, cosSigma)
+        sinAlpha = cosU1[todo] * cosU2[todo] * sinLambda / sinSigma
+        cosSqAlpha = 1 - sinAlpha ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos2SigmaM = np.where(cosSqAlpha != 0, cosSigma - 2 * sinU1[todo] * sinU2[todo] / cosSqAlpha, 0)
+        C = WGS84_F_16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+        LambdaPrev = Lambda
+        Lambda = L[todo] + (1 - C) * f * sinAlpha * (sigma + C * sinSigma *
+                                                     (cos2SigmaM + C * cosSigma *
+                                                      (-1 + 2 * cos2SigmaM ** 2)))
+        converged = np.abs(Lambda - LambdaPrev) < VINCENTY_CONVERGENCE_THRESHOLD
+        if converged.any():
+            uSq = cosSqAlpha[converged] * WGS84_A2_MINUS_B2 / WGS84_B2
+            A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+            B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+            c2SM = cos2SigmaM[converged]
+            sS = sinSigma[converged]
+            deltaSigma = B * sS * (c2SM + B / 4 * (cosSigma[converged] *
+                                                   (-1 + 2 * c2SM ** 2) - B / 6 * c2SM *
+                                                   (-3 + 4 * sS ** 2) * (-3 + 4 * c2SM ** 2)))
+            s[todo[converged]] = b * A * (sigma[converged] - deltaSigma)
+            todo = todo[~converged]
+            Lambda = Lambda[~converged]
+    s[todo] = np.nan
+
+    return np.round(s, 6)
+
+def _add_distances(gps: list):
+    """
+    Add cumulative distance information to time-sorted gps data
+
+    Parameters
+    ----------
+    gps : list of tuples
+        [(time, lat, long, alti, dist, hr, cad),(...)]
+
+    Returns
+    -------
+    None
+        Changes are made in place
+    """
+
+    # Work on the coordinate columns rather than record by record
+    #time, lat, long, [alti], [dist], [hr], [cad]
+    lat = [entry[1] for entry in gps]
+    lon = [entry[2] for entry in gps]
+
+    # Calculate distances between consecutive points based on vincenty distances.
+    # Each point is in two pairs, so its reduced latitude is calculated just once,
+    # and very close points aren't iterated, their haversine distance is used instead
+    # TODO: Try other point-to-point distance calculations
+    if numpy_found and gps:
+        lat, lon = np.array(lat), np.array(lon)
+        distances = _vincenty_vec(lat, lon)
+        # Retry unconverged pairs one by one, so failures are reported as usual
+        for n in np.flatnonzero(np.isnan(distances)):
+            distances[n] = _vincenty((lat[n+1], lon[n+1]), (lat[n], lon[n]))
+    else:
+        reduced = [_reduced_latitude(latitude) for latitude in lat]
+        distances = []
+        for n in range(1, len(gps)):
+            if lat[n] == lat[n-1] and lon[n] == lon[n-1]:
+                distances.append(0.0)
+            else:
+                distance = round(_haversine(lat[n], lon[n], lat[n-1], lon[n-1]), 6)
+                if distance >= HAVERSINE_THRESHOLD:
+                    sinU1, cosU1 = reduced[n]
+                    sinU2, cosU2 = reduced[n-1]
+                    distance = _vincenty_reduced(sinU1, cosU1, sinU2, cosU2, math.radians(lon[n-1] - lon[n]))
+                distances.append(distance)
+
+    # Write the cumulative distance column back, the first gps-point has no distance
+    distances = itertools.chain([0], (float(distance) for distance in itertools.accumulate(distances)))
+    gps[:] = [(time, lat, lon, alti, distance, heart_rate, cadence)
+              for (time, lat, lon, alti, _, heart_rate, cadence), distance in zip(gps, distances)]
+
+def process_gps(data: dict) -> dict:
+    """
+    Add distance information to all gps tagged data points, if read_file
+    hasn't already done so
+
+    Parameters
+    ----------
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
+
+    Returns
+    -------
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
+    """
 
     print('processing gps: ', end='')
     try:
-        # Loop through data line by line
-        for n, entry in enumerate(data['gps']):
-            # Calculate distances between points based on vincenty distances
-            if n == 0: # first gps-point has no distance
-                #time, lat, long, [alti], [dist], [hr], [cad]
-                entry[4] = 0
-            else:
-                # TODO: Try other point-to-point distance calculations
-                entry[4] = (_vincenty((float(entry[1]),float(entry[2])),
-                                      (float(data['gps'][n-1][1]),float(data['gps'][n-1][2])))+data['gps'][n-1][4])
+        if data['gps'] and data['gps'][0][4] is None:
+            _add_distances(data['gps'])
 
-    except:
+    except ArithmeticError: # Distance calculation did not converge
         print('FAILED')
         exit()
 
@@ -346,17 +574,17 @@ def file_details(data: dict, options: dict) -> tuple:
 
     Parameters
     ----------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists, 'lap': list of lists}
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples, 'lap': list of lists}
     options: dictionary of boolean/string
         {'filter': boolean, 'validate': boolean, 'sport': string}
 
     Returns
     -------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
     lap stats: list of lists
-        {'start_time': float, 'stop_time' :float, 'duration' :float, 'distance': float}
+        {'start_time': int, 'stop_time' :int, 'duration' :int, 'distance': float}
     """
     # time, lat, long, [alti], [dist], [hr], [cad]
     try:
@@ -387,7 +615,7 @@ def file_details(data: dict, options: dict) -> tuple:
         stats['duration'] = str(stats['duration'])
         stats['distance'] = str(int(stats['distance']))
 
-    except:
+    except (IndexError, ValueError, OverflowError, OSError): # No data, or timestamps out of range
         print('Something went wrong :-(')
         exit()
 
@@ -403,8 +631,8 @@ def calculate_lap_stats(data: dict) -> list:
 
     Parameters
     ----------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists, 'lap' list of lists}
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples, 'lap' list of lists}
 
 
     Returns
@@ -415,21 +643,22 @@ def calculate_lap_stats(data: dict) -> list:
     lap_stats = []
 
     try:
+        # Sorted gps timestamps, so each lap's first and last gps record can be found by bisection
+        times = [gps_data[0] for gps_data in data['gps']]
+
         for n, lap_data in enumerate(data['lap']):
             # Append lap duration
             lap_data.append(lap_data[1] - lap_data[0])
-            # Append lap distance. Calculate lap distance via lookup in gps data between lap start and stop times
-            for m, gps_data in enumerate(data['gps']):
-                if gps_data[0] == lap_data[0]:  # gps record for start of lap found
-                    start_distance = gps_data[4]
-                elif gps_data[0] == lap_data[1]:  # gps record for end of lap found
-                    lap_data.append(gps_data[4] - start_distance)
-                    break
+            # Append lap distance. Calculate lap distance from the first gps record at or after the
+            # lap start to the last gps record at or before the lap stop
+            start = bisect.bisect_left(times, lap_data[0])
+            stop = bisect.bisect_right(times, lap_data[1]) - 1
+            lap_data.append(data['gps'][stop][4] - data['gps'][start][4])
 
             # Add calculated lap stats to result list
             lap_stats.append(lap_data)
 
-    except:
+    except IndexError: # No gps data for a lap
         print('generate_lap_stats FAILED')
         exit()
 
@@ -443,34 +672,37 @@ def merge_data(data: dict) -> list:
 
     Parameters
     ----------
-    data : dictionary of lists of lists
-        {'gps': list of lists, 'alti': list of lists, 'hr': list of lists, 'cad': list of lists}
+    data : dictionary of lists of tuples
+        {'gps': list of tuples, 'alti': list of tuples, 'hr': list of tuples, 'cad': list of tuples}
 
     Returns
     -------
-    data : list of lists
-        [[time, lat, long, alti, dist, hr, cad],[...]]
+    data : list of tuples (lists where timestamps were merged)
+        [(time, lat, long, alti, dist, hr, cad),[...]]
     """
 
     print('processing heart-rate/cadence: ', end='')
-    # Sort data array chronologically
+    # Interleave the (individually sorted) data arrays chronologically
     try:
-        data = data['gps']+data['alti']+data['hr']+data['cad'] #time, lat, long, alti, dist, hr, cad
         gettime = operator.itemgetter(0)
-        data = sorted(data, key=gettime)
-
-        # Merge duplicated timestamps
-        for n, entry in enumerate(data):
-            if n == 0:
-                pass
+        data = heapq.merge(data['gps'], data['alti'], data['hr'], data['cad'], key=gettime) #time, lat, long, alti, dist, hr, cad
+
+        # Merge duplicated timestamps, only records that need merging are copied into lists
+        # Later values win, so of several gps fixes in the same second only the last position is kept
+        merged = []
+        for entry in data:
+            if merged and entry[0] == merged[-1][0]: #if timestamp is same as previous
+                previous = merged[-1]
+                if type(previous) is tuple:
+                    previous = merged[-1] = list(previous)
+                for x in range(1,7):
+                    if entry[x] is not None:
+                        previous[x] = entry[x] #copy all data back to previous
             else:
-                if entry[0] == data[n-1][0]: #if timestamp is same as previous
-                    for x in range(1,7):
-                        if entry[x]:
-                            data[n-1][x] = entry[x] #copy all data back to previous
-                    data.remove(entry) #and delete current
+                merged.append(entry)
+        data = merged
 
-    except:
+    except TypeError: # Timestamps that can't be compared
         print('FAILED')
         exit()
 
@@ -478,222 +710,160 @@ def merge_data(data: dict) -> list:
     return data
 
 
-def generate_xml(data: list, lap_stats: list, options: dict) -> ET.Element:
+def save_xml(data: list, lap_stats: list, options: dict, input_file: str) -> str:
     """
-    Generate xml file from extracted data and user options
+    Generate TCX (XML) file from extracted data and user options, writing it
+    straight to disk as it goes
 
     Parameters
     ----------
-    data : list of lists
-        [[time, lat, long, alti, dist, hr, cad],[...]]
+    data : list of tuples/lists
+        [(time, lat, long, alti, dist, hr, cad),[...]]
     lap_stats : list of lists
-        {'start_time': float, 'stop_time': float, 'duration': float, 'distance': float}
+        {'start_time': int, 'stop_time': int, 'duration': int, 'distance': float}
     options: dictionary of boolean/string
         {'filter': boolean, 'validate': boolean, 'sport': string}
+    input_file : string
+        Input file name
 
     Returns
     -------
-    TrainingCenterDatabase : ET.Element
+    new_filename : string or None
+        Final filename, or None if no file was written
     """
 
     print('\n---- XML file ----')
-    print('generating: ', end='')
+    print('saving: ', end='')
 
+    # Without any laps there's no activity to write, so don't leave a broken file
+    if not lap_stats:
+        print('FAILED')
+        return None
+
+    new_filename = input_file+'.tcx'
     try:
-        # TrainingCenterDatabase
-        TrainingCenterDatabase = ET.Element('TrainingCenterDatabase')
-        TrainingCenterDatabase.set('xsi:schemaLocation','http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd')
-        TrainingCenterDatabase.set('xmlns', 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2')
-        TrainingCenterDatabase.set('xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
-        TrainingCenterDatabase.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
-        TrainingCenterDatabase.set('xmlns:ns3', 'http://www.garmin.com/xmlschemas/ActivityExtension/v2')
-        ## Activities
-        Activities = ET.SubElement(TrainingCenterDatabase,'Activities')
-
-        ### Activity
-        Activity = ET.SubElement(Activities,'Activity')
-        Activity.set('Sport',options['sport'])
-        Id = ET.SubElement(Activity,'Id')
-        Id.text = dt.utcfromtimestamp(lap_stats[0][0]).isoformat('T', 'seconds')+'.000Z'  # The StartTime timestamp
-
-        #### Lap
-        for n, stats in enumerate(lap_stats):
-            Lap = ET.SubElement(Activity,'Lap')
-            Lap.set('StartTime',dt.utcfromtimestamp(stats[0]).isoformat('T', 'seconds')+'.000Z')
-            TotalTimeSeconds = ET.SubElement(Lap,'TotalTimeSeconds')
-            TotalTimeSeconds.text = str(int(stats[2]))
-            DistanceMeters = ET.SubElement(Lap,'DistanceMeters')
-            DistanceMeters.text = str(int(stats[3]))
-            Calories = ET.SubElement(Lap,'Calories')
-            Calories.text = '0' # TODO: Can we nullify or get rid of this?
-            # Or is this present in data from some devices?
-            Intensity = ET.SubElement(Lap,'Intensity')
-            Intensity.text = 'Active' # TODO: Can we nullify or get rid of this?
-            TriggerMethod = ET.SubElement(Lap,'TriggerMethod')
-            TriggerMethod.text = 'Manual' # TODO: How are Laps (or Tracks?) split?
-            Track = ET.SubElement(Lap,'Track')
-
-            ##### Track
-            distance_holder = 0
-            for line in data:
+        with open(new_filename, 'w', encoding='utf-8', newline='\n') as f:
+            # TrainingCenterDatabase
+            f.write('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<TrainingCenterDatabase'
+                    ' xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd"'
+                    ' xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"'
+                    ' xmlns:xsd="http://www.w3.org/2001/XMLSchema"'
+                    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                    ' xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n')
+            ## Activities
+            f.write('  <Activities>\n')
+
+            ### Activity
+            f.write('    <Activity Sport="'+options['sport']+'">\n')
+            f.write('      <Id>'+dt.utcfromtimestamp(lap_stats[0][0]).isoformat('T', 'seconds')+'.000Z</Id>\n')  # The StartTime timestamp
+
+            #### Lap
+            times = [line[0] for line in data] # data is sorted by time
+            # Format all timestamps for saving in one go
+            time_strings = [dt.utcfromtimestamp(time).isoformat('T', 'seconds')+'.000Z' for time in times]
+            for n, stats in enumerate(lap_stats):
+                f.write('      <Lap StartTime="'+dt.utcfromtimestamp(stats[0]).isoformat('T', 'seconds')+'.000Z">\n'
+                        '        <TotalTimeSeconds>'+str(int(stats[2]))+'</TotalTimeSeconds>\n'
+                        '        <DistanceMeters>'+str(int(stats[3]))+'</DistanceMeters>\n'
+                        '        <Calories>0</Calories>\n' # TODO: Can we nullify or get rid of this?
+                        # Or is this present in data from some devices?
+                        '        <Intensity>Active</Intensity>\n' # TODO: Can we nullify or get rid of this?
+                        '        <TriggerMethod>Manual</TriggerMethod>\n') # TODO: How are Laps (or Tracks?) split?
+
+                ##### Track
                 # Only add lines between start and stop time of current lap
-                if (line[0] < stats[0]) or (line[0] > stats[1]):
+                start = bisect.bisect_left(times, stats[0])
+                stop = bisect.bisect_right(times, stats[1])
+                if start == stop:
+                    f.write('        <Track />\n')
+                    f.write('      </Lap>\n')
                     continue
-                # format data for saving
-                formattedline_0 = dt.utcfromtimestamp(line[0]).isoformat('T', 'seconds')+'.000Z'  #time
-                formattedline_1 = str(line[1]) #lat
-                formattedline_2 = str(line[2]) #long
-                formattedline_3 = str(line[3]) #alti
-                formattedline_4 = str(line[4]) #distance
-                formattedline_5 = str(line[5]) #heart-rate
-                formattedline_6 = str(line[6]) #cadence
-
-                Trackpoint = ET.SubElement(Track,'Trackpoint')
-                Time = ET.SubElement(Trackpoint,'Time')
-                Time.text = formattedline_0
-
-                if formattedline_1:
-                    Position = ET.SubElement(Trackpoint,'Position')
-                    LatitudeDegrees = ET.SubElement(Position,'LatitudeDegrees')
-                    LatitudeDegrees.text = formattedline_1
-                    LongitudeDegrees = ET.SubElement(Position,'LongitudeDegrees')
-                    LongitudeDegrees.text = formattedline_2
-
-                if formattedline_3:
-                    AltitudeMeters = ET.SubElement(Trackpoint,'AltitudeMeters')
-                    AltitudeMeters.text = formattedline_3
-                    # TODO: Some (all?) Huawei devices don't collect Altitude data,
-                    # but in that case can we call on some open API to estimate it?
-
-                if formattedline_1:
-                    DistanceMeters = ET.SubElement(Trackpoint,'DistanceMeters')
-                    DistanceMeters.text = formattedline_4
-                    # TODO: Do any Huawei devices collect this?
-
-                if formattedline_5:
-                    HeartRateBpm = ET.SubElement(Trackpoint,'HeartRateBpm')
-                    HeartRateBpm.set('xsi:type','HeartRateInBeatsPerMinute_t')
-                    Value = ET.SubElement(HeartRateBpm, 'Value')
-                    Value.text = formattedline_5
-
-                if formattedline_6:
-                    if options['sport'] == 'Biking':
-                        Cadence = ET.SubElement(Trackpoint, 'Cadence')
-                        Cadence.text = formattedline_6
-                    elif options['sport'] == 'Running':
-                        Extensions = ET.SubElement(Trackpoint, 'Extensions')
-                        TPX = ET.SubElement(Extensions, 'TPX')
-                        TPX.set('xmlns','http://www.garmin.com/xmlschemas/ActivityExtension/v2')
-                        RunCadence = ET.SubElement(TPX, 'RunCadence')
-                        RunCadence.text = formattedline_6
-
-        #### Creator
-        # TODO: See if we can scrape this data from other files in the .tar
-        Creator = ET.SubElement(Activity,'Creator')
-        Creator.set('xsi:type','Device_t')
-        Name = ET.SubElement(Creator,'Name')
-        Name.text = 'Huawei Fitness Tracking Device'
-        UnitId = ET.SubElement(Creator,'UnitId')
-        UnitId.text = '0000000000'
-        ProductID = ET.SubElement(Creator,'ProductID')
-        ProductID.text = '0000'
-        Version = ET.SubElement(Creator,'Version')
-        VersionMajor = ET.SubElement(Version,'VersionMajor')
-        VersionMajor.text = '0'
-        VersionMinor = ET.SubElement(Version,'VersionMinor')
-        VersionMinor.text = '0'
-        BuildMajor = ET.SubElement(Version,'BuildMajor')
-        BuildMajor.text = '0'
-        BuildMinor = ET.SubElement(Version,'BuildMinor')
-        BuildMinor.text = '0'
-
-        ## Author
-        Author = ET.SubElement(TrainingCenterDatabase,'Author')
-        Author.set('xsi:type','Application_t') # TODO: Check this is right
-        Name = ET.SubElement(Author,'Name')
-        Name.text = 'Huawei_TCX_Converter'
-        Build = ET.SubElement(Author,'Build')
-        Version = ET.SubElement(Build,'Version')
-        VersionMajor = ET.SubElement(Version,'VersionMajor')
-        VersionMajor.text = '1'
-        VersionMinor = ET.SubElement(Version,'VersionMinor')
-        VersionMinor.text = '0'
-        BuildMajor = ET.SubElement(Version,'BuildMajor')
-        BuildMajor.text = '1'
-        BuildMinor = ET.SubElement(Version,'BuildMinor')
-        BuildMinor.text = '0'
-        LangID = ET.SubElement(Author,'LangID')
-        LangID.text = 'en' # TODO: Translations? Probably not...
-        PartNumber = ET.SubElement(Author,'PartNumber')
-        PartNumber.text = '000-00000-00'
-
-        print('OKAY')
-    except:
-        print('FAILED')
-
-    return TrainingCenterDatabase
-
-def indent(elem: ET.Element, level: int = 0):
-    """
-    Adds whitespace to xml files to improve readability
-
-    Parameters
-    ----------
-    elem : ET.Element or ET.SubElement
-        Text information to indent
-
-    level : int
-        Indentation level desired
-
-    Returns
-    -------
-    None
-        Changes are made in place
-    """
 
-    i = "\n" + level*"  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+                f.write('        <Track>\n')
+                for line, formatted_time in zip(data[start:stop], time_strings[start:stop]): #time is preformatted
+                    time, lat, lon, alti, distance, heart_rate, cadence = line
+
+                    trackpoint = ['          <Trackpoint>\n',
+                                  '            <Time>', formatted_time, '</Time>\n']
+
+                    if lat is not None:
+                        trackpoint += ['            <Position>\n',
+                                       '              <LatitudeDegrees>', str(lat), '</LatitudeDegrees>\n',
+                                       '              <LongitudeDegrees>', str(lon), '</LongitudeDegrees>\n',
+                                       '            </Position>\n']
+
+                    if alti is not None:
+                        trackpoint += ['            <AltitudeMeters>', str(alti), '</AltitudeMeters>\n']
+                        # TODO: Some (all?) Huawei devices don't collect Altitude data,
+                        # but in that case can we call on some open API to estimate it?
+
+                    if lat is not None:
+                        trackpoint += ['            <DistanceMeters>', str(distance), '</DistanceMeters>\n']
+                        # TODO: Do any Huawei devices collect this?
+
+                    if heart_rate is not None:
+                        trackpoint += ['            <HeartRateBpm xsi:type="HeartRateInBeatsPerMinute_t">\n',
+                                       '              <Value>', str(heart_rate), '</Value>\n',
+                                       '            </HeartRateBpm>\n']
+
+                    if cadence is not None:
+                        if options['sport'] == 'Biking':
+                            trackpoint += ['            <Cadence>', str(cadence), '</Cadence>\n']
+                        elif options['sport'] == 'Running':
+                            trackpoint += ['            <Extensions>\n',
+                                           '              <TPX xmlns="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n',
+                                           '                <RunCadence>', str(cadence), '</RunCadence>\n',
+                                           '              </TPX>\n',
+                                           '            </Extensions>\n']
+
+                    trackpoint.append('          </Trackpoint>\n')
+                    f.write(''.join(trackpoint))
+
+                f.write('        </Track>\n')
+                f.write('      </Lap>\n')
+
+            #### Creator
+            # TODO: See if we can scrape this data from other files in the .tar
+            f.write('      <Creator xsi:type="Device_t">\n'
+                    '        <Name>Huawei Fitness Tracking Device</Name>\n'
+                    '        <UnitId>0000000000</UnitId>\n'
+                    '        <ProductID>0000</ProductID>\n'
+                    '        <Version>\n'
+                    '          <VersionMajor>0</VersionMajor>\n'
+                    '          <VersionMinor>0</VersionMinor>\n'
+                    '          <BuildMajor>0</BuildMajor>\n'
+                    '          <BuildMinor>0</BuildMinor>\n'
+                    '        </Version>\n'
+                    '      </Creator>\n')
+            f.write('    </Activity>\n')
+            f.write('  </Activities>\n')
+
+            ## Author
+            f.write('  <Author xsi:type="Application_t">\n' # TODO: Check this is right
+                    '    <Name>Huawei_TCX_Converter</Name>\n'
+                    '    <Build>\n'
+                    '      <Version>\n'
+                    '        <VersionMajor>1</VersionMajor>\n'
+                    '        <VersionMinor>0</VersionMinor>\n'
+                    '        <BuildMajor>1</BuildMajor>\n'
+                    '        <BuildMinor>0</BuildMinor>\n'
+                    '      </Version>\n'
+                    '    </Build>\n'
+                    '    <LangID>en</LangID>\n' # TODO: Translations? Probably not...
+                    '    <PartNumber>000-00000-00</PartNumber>\n'
+                    '  </Author>\n')
+            f.write('</TrainingCenterDatabase>\n')
 
-def save_xml(TrainingCenterDatabase: ET.Element, input_file: str) -> str:
-    """
-    Saves TCX file as XML
-
-    Parameters
-    ----------
-    TrainingCenterDatabase : ET.Element
-        XML data structure to save
-
-    input_file : string
-        Input file name
-
-    Returns
-    -------
-    new_filename : string
-        Final filename
-    """
-
-    print('saving: ', end='')
-    try:
-        tree = ET.ElementTree(TrainingCenterDatabase)
-        indent(TrainingCenterDatabase)
-        new_filename = input_file+'.tcx'
-        with open(new_filename, 'wb') as f:
-            f.write('<?xml version="1.0" encoding="UTF-8"?>'.encode('utf8'))
-            tree.write(f, 'utf-8')
         print('OKAY')
-    except:
+    except (OSError, ValueError, OverflowError): # Can't write file, or timestamps out of range
         print('FAILED')
+        # Don't leave a half-written file behind
+        try:
+            os.remove(new_filename)
+        except OSError:
+            pass
+        return None
 
     return new_filename
 
@@ -727,7 +897,7 @@ def validate_xml(filename: str, xmlschema_found: bool):
                 # Validate
                 schema.validate(filename)
                 print('OKAY')
-        except:
+        except (OSError, SyntaxError, xmlschema.XMLSchemaException): # Can't download schema, or file isn't valid
             print('FAILED')
     else:
         print('FAILED: xmlschema not found')
@@ -739,9 +909,8 @@ def main():
     if options['filter']: data = filter_data(data)
     data = process_gps(data)
     data, lap_stats = file_details(data, options)
-    TrainingCenterDatabase = generate_xml(data, lap_stats, options)
-    filename = save_xml(TrainingCenterDatabase, input_file)
-    if options['validate']: validate_xml(filename, xmlschema_found)
+    filename = save_xml(data, lap_stats, options, input_file)
+    if options['validate'] and filename: validate_xml(filename, xmlschema_found)
 
     # Whitespace improves formatting
     print('\n')